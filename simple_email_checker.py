@@ -5,7 +5,6 @@ This script reads company names from an Excel file and checks Gmail
 for emails from those companies, reporting which ones you've received emails from.
 
 Requirements:
-- pandas
 - google-api-python-client
 - google-auth
 - google-auth-oauthlib
@@ -21,26 +20,99 @@ Setup instructions:
 """
 
 import os
-import base64
-import pandas as pd
+import re
+import json
+import logging
+import time
+import random
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from html import unescape
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+from openpyxl import load_workbook
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    # The progress bar is optional: pip install tqdm
+    tqdm = None
+
+try:
+    import ahocorasick
+except ImportError:
+    # Faster keyword matching is optional: pip install pyahocorasick
+    ahocorasick = None
+
+try:
+    from pybase64 import urlsafe_b64decode
+except ImportError:
+    # Faster base64 decoding is optional: pip install pybase64
+    from base64 import urlsafe_b64decode
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    # Faster HTML parsing is optional: pip install selectolax
+    LexborHTMLParser = None
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    # HTML parsing falls back to BeautifulSoup: pip install beautifulsoup4
+    BeautifulSoup = None
 
 # If modifying these SCOPES, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 EXCEL_FILE_PATH = r"E:\Jobs\Applied Jobs.xlsx"  # Update with your Excel file path
 DAYS_TO_CHECK = 30  # How many days back to check for emails
+BATCH_SIZE = 100  # Maximum number of requests Gmail accepts in one batch
+# Only the parts of a message we actually read (headers and text bodies);
+# drops snippet, labels, size estimates, part filenames, attachment ids, etc.
+MESSAGE_FIELDS = 'id,payload(headers(name,value),mimeType,body/data,parts(mimeType,body/data,parts))'
+MAX_EMAILS_PER_COMPANY = 5  # Limit fetched emails to avoid excessive API calls
+MAX_BODY_LENGTH = 100000  # Characters of an email body kept and searched for keywords
+MAX_ATTEMPTS = 5  # How many times to try a rate-limited or failed Gmail request
+# Gmail allows 250 quota units per second per user; list and get cost 5 each
+REQUESTS_PER_SECOND = 40
+CACHE_FILE = 'gmail_cache.db'  # Local cache of downloaded emails, safe to delete
+QUERY_CHUNK_SIZE = 20  # Companies per Gmail search, keeps queries under the length limit
+MAX_WORKERS = 10  # How many Gmail searches to run at the same time
+
+# Common corporate suffixes, only stripped from the end of a company name
+_SUFFIX_RE = re.compile(r'\s+(?:inc|llc|corp(?:oration)?|ltd|limited|group)\.?\s*$', re.IGNORECASE)
+_WORD_RE = re.compile(r'\w+')
+# Rate limiting and temporary server errors
+_RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+# Reasons Gmail gives for 403 errors that clear up when retried
+_RETRYABLE_REASONS = frozenset(['rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded'])
+# Labels of messages that Gmail searches leave out by default
+_HIDDEN_LABELS = frozenset(['SPAM', 'TRASH'])
 
-def get_gmail_service():
-    """Authenticates and returns a Gmail service object."""
-    creds = None
+logger = logging.getLogger(__name__)
+_thread_local = threading.local()
+_credentials = None
+
+def get_credentials():
+    """Authenticates and returns the user's Gmail credentials, cached in memory."""
+    global _credentials
+    creds = _credentials
+    if creds and creds.valid:
+        return creds
+    
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first time.
-    if os.path.exists('token.json'):
+    if creds is None and os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
     
     # If there are no (valid) credentials available, let the user log in.
@@ -54,55 +126,308 @@ def get_gmail_service():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
 
-    return build('gmail', 'v1', credentials=creds)
+    _credentials = creds
+    return creds
+
+def _thread_http(credentials):
+    """Returns an authorized Http object for the current thread."""
+    http = getattr(_thread_local, 'http', None)
+    if http is None or http.credentials is not credentials:
+        http = _thread_local.http = AuthorizedHttp(credentials, http=build_http())
+    return http
+
+@lru_cache(maxsize=1)
+def get_gmail_service(creds):
+    """Returns a Gmail service object for the given credentials."""
+    return build('gmail', 'v1', http=_thread_http(creds), static_discovery=True, cache_discovery=False)
 
 def load_companies():
     """Loads company names from Excel file."""
     try:
-        df = pd.read_excel(EXCEL_FILE_PATH)
-        
-        # Check for our expected column
-        if 'Company_Name' not in df.columns:
-            print(f"Error: 'Company_Name' column not found in Excel file.")
-            return []
+        # Stream the rows instead of building a DataFrame for a single column
+        workbook = load_workbook(EXCEL_FILE_PATH, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            header = next(sheet.iter_rows(max_row=1, values_only=True), ())
             
-        # Extract unique company names
-        companies = df['Company_Name'].dropna().unique().tolist()
-        return companies
+            # Check for our expected column
+            if 'Company_Name' not in header:
+                print(f"Error: 'Company_Name' column not found in Excel file.")
+                return []
+            column = header.index('Company_Name') + 1
+            
+            # Extract unique company names, keeping spreadsheet order
+            names = (row[0] for row in sheet.iter_rows(min_row=2, min_col=column, max_col=column,
+                                                        values_only=True))
+            companies = list(dict.fromkeys(name for name in names if name is not None))
+            return companies
+        finally:
+            workbook.close()
     except Exception as e:
         print(f"Error loading Excel file: {e}")
         return []
 
-def extract_email_content(service, msg_id, company_name):
-    """Extracts email content from a message ID and categorizes it."""
+class RateLimiter:
+    """Thread-safe token bucket that paces requests to a fixed rate."""
+
+    def __init__(self, rate, period=1.0):
+        self.rate = rate
+        self.period = period
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` requests may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.period)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens * self.period / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+_rate_limiter = RateLimiter(REQUESTS_PER_SECOND)
+
+def _is_retryable(error):
+    """Returns True for Gmail errors that are worth retrying (rate limits and server errors)."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    if status in _RETRYABLE_STATUSES:
+        return True
+    details = getattr(error, 'error_details', None)
+    if status != 403 or not isinstance(details, list):
+        return False
+    return any(isinstance(detail, dict) and detail.get('reason') in _RETRYABLE_REASONS
+               for detail in details)
+
+def _retry_delay(error, attempt):
+    """Returns how long to wait before retrying, honoring any Retry-After header."""
+    retry_after = error.resp.get('retry-after')
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return min(2 ** attempt, 64) + random.uniform(0, 1)
+
+def _with_retry(fn, *, cost=1, max_attempts=MAX_ATTEMPTS):
+    """Calls fn(), retrying with exponential backoff on rate limits and server errors."""
+    for attempt in range(max_attempts):
+        _rate_limiter.acquire(cost)
+        try:
+            return fn()
+        except HttpError as error:
+            if attempt == max_attempts - 1 or not _is_retryable(error):
+                raise
+            logger.warning("Gmail request failed (%s), retrying (attempt %d of %d)...",
+                           error.resp.status, attempt + 1, max_attempts)
+            time.sleep(_retry_delay(error, attempt))
+
+def batch_get_messages(service, msg_ids, description=None, **params):
+    """Runs messages.get for many messages in batches, returning {msg_id: (response, exception)}."""
+    responses = {}
+
+    def _collect(request_id, response, exception):
+        responses[request_id] = (response, exception)
+
+    progress = None
+    if tqdm is not None and description and msg_ids:
+        progress = tqdm(total=len(msg_ids), desc=description, unit="email")
+
+    pending = list(msg_ids)
+    for attempt in range(MAX_ATTEMPTS):
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=_collect)
+            for msg_id in pending[start:start + BATCH_SIZE]:
+                batch.add(service.users().messages().get(userId='me', id=msg_id, **params),
+                          request_id=msg_id)
+            # A batch counts as one request per message against the quota
+            inner_requests = len(pending[start:start + BATCH_SIZE])
+            try:
+                _with_retry(batch.execute, cost=inner_requests)
+            except HttpError as error:
+                logger.error("An error occurred while fetching messages: %s", error)
+            if progress is not None and attempt == 0:
+                progress.update(inner_requests)
+
+        # Requests inside a batch can be rate limited individually; retry just those
+        throttled = [msg_id for msg_id in pending
+                     if _is_retryable(responses.get(msg_id, (None, None))[1])]
+        if not throttled or attempt == MAX_ATTEMPTS - 1:
+            break
+        time.sleep(max(_retry_delay(responses[msg_id][1], attempt) for msg_id in throttled))
+        pending = throttled
+
+    if progress is not None:
+        progress.close()
+    return responses
+
+def fetch_email_contents(service, company_msg_ids, headers):
+    """Fetches and categorizes the messages found for each company in {company_name: [msg_id, ...]}."""
+    cache = get_email_cache()
+    all_msg_ids = list(dict.fromkeys(msg_id for msg_ids in company_msg_ids.values() for msg_id in msg_ids))
+    cached = load_cached_emails(cache, all_msg_ids)
+    
+    subject_categories = {}
+    for msg_id in all_msg_ids:
+        if msg_id not in cached and msg_id in headers:
+            match = _find_category_keyword(headers[msg_id][1].lower())
+            if match:
+                subject_categories[msg_id] = match[0]
+    
+    responses = batch_get_messages(service, [msg_id for msg_id in all_msg_ids
+                                             if msg_id not in cached and msg_id not in subject_categories],
+                                   description="Downloading emails", format='full', fields=MESSAGE_FIELDS)
+
+    results = {}
+    fetched = {}
+    for company_name, msg_ids in company_msg_ids.items():
+        emails = results[company_name] = []
+        for msg_id in msg_ids:
+            # A message matching several companies is only parsed once; the
+            # other companies just categorize its body again
+            parsed = cached.get(msg_id) or fetched.get(msg_id)
+            if parsed is not None:
+                email_data = dict(parsed)
+                email_data['category'] = categorize_email(email_data['body'], company_name)
+                emails.append(email_data)
+                continue
+            
+            if msg_id in subject_categories:
+                emails.append(subject_email_content(headers[msg_id], subject_categories[msg_id]))
+                continue
+            
+            message, exception = responses.get(msg_id, (None, 'no response from Gmail'))
+            if exception is not None:
+                logger.error("Error extracting email content: %s", exception)
+                emails.append(error_email_content(exception))
+            else:
+                email_data = parse_email_message(message, company_name)
+                if email_data['category'] != 'Error':
+                    fetched[msg_id] = email_data
+                emails.append(email_data)
+    
+    store_cached_emails(cache, fetched)
+    return results
+
+@lru_cache(maxsize=None)
+def get_email_cache(path=CACHE_FILE):
+    """Opens (and creates if needed) the SQLite cache of downloaded emails."""
+    cache = sqlite3.connect(path)
+    cache.execute('CREATE TABLE IF NOT EXISTS emails ('
+                  'msg_id TEXT PRIMARY KEY, subject TEXT, sender TEXT, date INTEGER, body TEXT)')
+    cache.execute('CREATE TABLE IF NOT EXISTS message_headers ('
+                  'msg_id TEXT PRIMARY KEY, sender TEXT, subject TEXT, internal_date INTEGER, snippet TEXT)')
+    # Ids of the messages in the checked date window, kept in sync through the Gmail history
+    cache.execute('CREATE TABLE IF NOT EXISTS mailbox (msg_id TEXT PRIMARY KEY)')
+    cache.execute('CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)')
+    return cache
+
+def _select_by_msg_ids(cache, columns, table, msg_ids):
+    """Yields the cached rows for the given message ids."""
+    for start in range(0, len(msg_ids), 500):
+        chunk = list(msg_ids[start:start + 500])
+        placeholders = ','.join('?' * len(chunk))
+        yield from cache.execute(f'SELECT msg_id, {columns} FROM {table} '
+                                 f'WHERE msg_id IN ({placeholders})', chunk)
+
+def load_cached_emails(cache, msg_ids):
+    """Returns {msg_id: email_data} for the given messages found in the cache."""
+    return {
+        msg_id: {
+            'subject': subject,
+            'sender': sender,
+            'date': datetime.fromtimestamp(date).astimezone() if date is not None else None,
+            'body': body,
+            'html': '',
+        }
+        for msg_id, subject, sender, date, body
+        in _select_by_msg_ids(cache, 'subject, sender, date, body', 'emails', msg_ids)
+    }
+
+def store_cached_emails(cache, emails):
+    """Saves {msg_id: email_data} to the cache."""
+    cache.executemany(
+        'INSERT OR REPLACE INTO emails (msg_id, subject, sender, date, body) VALUES (?, ?, ?, ?, ?)',
+        [(msg_id, email['subject'], email['sender'],
+          int(email['date'].timestamp()) if email['date'] else None, email['body'])
+         for msg_id, email in emails.items()])
+    cache.commit()
+
+def fetch_message_headers(service, msg_ids):
+    """Returns {msg_id: (sender, subject, internal_date, snippet)} for the given messages."""
+    cache = get_email_cache()
+    headers = {msg_id: (sender, subject, internal_date, snippet)
+               for msg_id, sender, subject, internal_date, snippet
+               in _select_by_msg_ids(cache, 'sender, subject, internal_date, snippet', 'message_headers', msg_ids)}
+
+    missing = [msg_id for msg_id in msg_ids if msg_id not in headers]
+    responses = batch_get_messages(service, missing, description="Scanning emails", format='metadata',
+                                   metadataHeaders=['From', 'Subject'],
+                                   fields='id,internalDate,snippet,payload/headers')
+    fetched = {}
+    for msg_id, (message, exception) in responses.items():
+        if exception is not None:
+            logger.error("Error retrieving headers for message %s: %s", msg_id, exception)
+            continue
+        values = header_values(message['payload'].get('headers', []))
+        fetched[msg_id] = (values.get('from', ''), values.get('subject', ''), int(message['internalDate']),
+                           unescape(message.get('snippet', '')))
+
+    cache.executemany('INSERT OR REPLACE INTO message_headers (msg_id, sender, subject, internal_date, snippet) '
+                      'VALUES (?, ?, ?, ?, ?)',
+                      [(msg_id, *values) for msg_id, values in fetched.items()])
+    cache.commit()
+    headers.update(fetched)
+    return headers
+
+def header_values(headers):
+    """Returns {lowercased header name: value} for a Gmail header list."""
+    return {header['name'].lower(): header['value'] for header in reversed(headers)}
+
+def subject_email_content(message_headers, category):
+    """Returns the email data of a message categorized from its subject alone."""
+    sender, subject, internal_date, snippet = message_headers
+    logger.debug("Categorized email '%s' from its subject: %s", subject, category)
+    return {
+        'subject': subject,
+        'sender': sender,
+        'date': datetime.fromtimestamp(internal_date / 1000).astimezone(),
+        'body': snippet,
+        'html': '',
+        'category': category
+    }
+
+def error_email_content(error):
+    """Returns the placeholder email data used when a message can't be retrieved."""
+    return {
+        'subject': 'Error retrieving subject',
+        'sender': 'Error retrieving sender',
+        'date': None,
+        'body': f'Error retrieving body: {error}',
+        'html': '',
+        'category': 'Error'
+    }
+
+def parse_email_message(message, company_name):
+    """Extracts email content from a Gmail message resource and categorizes it."""
     try:
-        # Fetch the full message
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        
-        # Get email headers
-        headers = message['payload']['headers']
-        subject = next((header['value'] for header in headers if header['name'] == 'Subject'), 'No Subject')
-        sender = next((header['value'] for header in headers if header['name'] == 'From'), 'Unknown Sender')
-        date_str = next((header['value'] for header in headers if header['name'] == 'Date'), '')
+        # Get email headers in a single pass over the header list
+        headers = header_values(message['payload']['headers'])
+        subject = headers.get('subject', 'No Subject')
+        sender = headers.get('from', 'Unknown Sender')
+        date_str = headers.get('date', '')
         
-        print(f"\nProcessing email: {subject}")
-        print(f"From: {sender}")
+        logger.debug("Processing email: %s", subject)
+        logger.debug("From: %s", sender)
         
-        # Parse the date using email.utils
-        date = None
-        if date_str:
-            try:
-                import email.utils
-                import time
-                
-                # Parse the date using email.utils which handles RFC 2822 format
-                parsed_date = email.utils.parsedate_tz(date_str)
-                if parsed_date:
-                    # Convert to datetime object
-                    timestamp = email.utils.mktime_tz(parsed_date)
-                    date = datetime.fromtimestamp(timestamp)
-            except Exception as e:
-                print(f"Error parsing date '{date_str}': {e}")
+        # Parse the RFC 2822 date header and convert it to local time
+        try:
+            date = parsedate_to_datetime(date_str).astimezone()
+        except (TypeError, ValueError):
+            date = None
+            if date_str:
+                logger.warning("Error parsing date '%s'", date_str)
         
         # Extract the email body
         plain_text = ""
@@ -117,43 +442,39 @@ def extract_email_content(service, msg_id, company_name):
             # Single part message
             mime_type = message['payload'].get('mimeType', '')
             data = message['payload']['body']['data']
-            decoded = base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
-            
             if mime_type == 'text/plain':
-                plain_text = decoded
+                plain_text = decode_text(data, MAX_BODY_LENGTH)
             elif mime_type == 'text/html':
-                html_content = decoded
+                html_content = decode_text(data)
         
         # Determine the final content to use
         body = ""
         if plain_text:
-            body = plain_text
+            body = plain_text[:MAX_BODY_LENGTH]
         elif html_content:
             # Try to extract text from HTML
             try:
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(html_content, 'html.parser')
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.extract()
-                # Get text
-                body = soup.get_text(separator=' ', strip=True)
-            except ImportError:
-                body = "[HTML Email - Install BeautifulSoup to extract text content]"
-                print("Warning: BeautifulSoup not installed. Install with 'pip install beautifulsoup4' for better HTML parsing.")
+                body = html_to_text(html_content)
             except Exception as e:
                 body = f"[Error extracting text from HTML: {e}]"
+            if body is not None:
+                body = body[:MAX_BODY_LENGTH]
+            else:
+                body = "[HTML Email - Install selectolax or BeautifulSoup to extract text content]"
+                logger.warning("No HTML parser installed. Install with 'pip install selectolax' "
+                               "or 'pip install beautifulsoup4' for HTML parsing.")
         
         # Categorize the email
-        print(f"\nAttempting to categorize email from '{company_name}':")
-        print(f"Subject: {subject}")
+        logger.debug("Attempting to categorize email from '%s':", company_name)
+        logger.debug("Subject: %s", subject)
         
         # Show a preview of the body to help with debugging
-        body_preview = body[:100].replace('\n', ' ') + "..." if len(body) > 100 else body
-        print(f"Body preview: {body_preview}")
+        if logger.isEnabledFor(logging.DEBUG):
+            body_preview = body[:100].replace('\n', ' ') + "..." if len(body) > 100 else body
+            logger.debug("Body preview: %s", body_preview)
         
         category = categorize_email(body, company_name)
-        print(f"Final category: {category}\n")
+        logger.debug("Final category: %s", category)
         
         return {
             'subject': subject,
@@ -164,15 +485,27 @@ def extract_email_content(service, msg_id, company_name):
             'category': category
         }
     except Exception as e:
-        print(f"Error extracting email content: {e}")
-        return {
-            'subject': 'Error retrieving subject',
-            'sender': 'Error retrieving sender',
-            'date': None,
-            'body': f'Error retrieving body: {e}',
-            'html': '',
-            'category': 'Error'
-        }
+        logger.error("Error extracting email content: %s", e)
+        return error_email_content(e)
+
+def html_to_text(html_content):
+    """Returns the readable text of an HTML email, or None when no HTML parser is installed."""
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html_content)
+        # Remove script and style elements
+        for tag in tree.css('script, style'):
+            tag.decompose()
+        # Like BeautifulSoup's get_text, include the text in <head> (e.g. <title>)
+        return tree.root.text(separator=' ', strip=True) if tree.root is not None else ''
+    
+    if BeautifulSoup is None:
+        return None
+    
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.extract()
+    return soup.get_text(separator=' ', strip=True)
 
 def manual_category_review(company_emails):
     """Allow manual review and adjustment of email categories."""
@@ -224,6 +557,79 @@ def manual_category_review(company_emails):
     print("\nManual review complete!")
     return company_emails
 
+# Keywords for different categories (both English and German), lowercased once
+# at import so categorize_email can match them against the lowercased body
+SUBMISSION_KEYWORDS = tuple(keyword.lower() for keyword in [
+    # English
+    "application received", "thank you for applying", "received your application", 
+    "successfully submitted", "confirm receipt", "has been received", "application confirmation",
+    "thank you for your interest", "thank you for submitting", "we've received your application",
+    # German
+    "bewerbung eingegangen", "vielen dank für ihre bewerbung", "bewerbung erhalten",
+    "erfolgreich eingereicht", "eingang bestätigen", "ist eingegangen", 
+    "bewerbungsbestätigung", "vielen dank für ihr interesse", "haben ihre bewerbung erhalten", "werden deine unterlagen prüfen"
+])
+
+REJECTION_KEYWORDS = tuple(keyword.lower() for keyword in [
+    # English
+    "regret to inform", "unable to proceed", "not moving forward", "we have decided",
+    "unfortunately", "not selected", "other candidates", "not successful",
+    "does not match", "position has been filled", "no longer available", "we decided to pursue",
+    # German
+    "leider", "bedauern", "nicht weiterverfolgen", "nicht entspricht", 
+    "andere kandidaten", "nicht erfolgreich", "nicht ausgewählt",
+    "position wurde besetzt", "nicht mehr verfügbar", "nicht weiterkommen",
+    "müssen wir ihnen mitteilen", "entschieden haben"
+])
+
+INTERVIEW_KEYWORDS = tuple(keyword.lower() for keyword in [
+    # English
+    "interview", "would like to invite", "next steps", "meet with", "discussion",
+    "schedule a call", "available for a", "assessment", "phone screening", "video call",
+    # German
+    "vorstellungsgespräch", "einladen", "nächste schritte", "termin vereinbaren",
+    "gespräch", "telefonat", "verfügbar für ein", "assessment", "telefoninterview",
+    "videoanruf", "kennenlernen"
+])
+
+# Categories in priority order: when keywords of several categories match,
+# the first one wins (interview is checked before rejection as it's more important)
+CATEGORY_KEYWORDS = (
+    ("Application Submitted", "submission", SUBMISSION_KEYWORDS),
+    ("Interview Request", "interview", INTERVIEW_KEYWORDS),
+    ("Application Rejected", "rejection", REJECTION_KEYWORDS),
+)
+
+def _build_keyword_automaton():
+    """Builds an Aho-Corasick automaton that finds all category keywords in one pass."""
+    automaton = ahocorasick.Automaton()
+    for priority, (category, label, keywords) in enumerate(CATEGORY_KEYWORDS):
+        for keyword in keywords:
+            if keyword not in automaton:
+                automaton.add_word(keyword, (priority, category, label, keyword))
+    automaton.make_automaton()
+    return automaton
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton() if ahocorasick is not None else None
+
+def _find_category_keyword(text):
+    """Returns (category, label, keyword) for the highest priority keyword in text, or None."""
+    if _KEYWORD_AUTOMATON is not None:
+        best = None
+        for _, match in _KEYWORD_AUTOMATON.iter(text):
+            if best is None or match[0] < best[0]:
+                best = match
+                if best[0] == 0:
+                    # Nothing outranks the first category, stop scanning
+                    break
+        return best[1:] if best is not None else None
+    
+    for category, label, keywords in CATEGORY_KEYWORDS:
+        for keyword in keywords:
+            if keyword in text:
+                return category, label, keyword
+    return None
+
 def categorize_email(email_body, company_name):
     """
     Categorize email based on keywords in both English and German.
@@ -235,80 +641,36 @@ def categorize_email(email_body, company_name):
     if not email_body:
         return "Other"
     
-    # Normalize the email body for better matching
+    # Normalize the email body and company name for better matching
     email_body_lower = email_body.lower()
+    company_name_lower = company_name.lower()
     
-    # Print some debugging info to see what we're analyzing
-    print(f"Analyzing email content for {company_name}...")
-    print(f"Email body length: {len(email_body_lower)} characters")
-    
-    # Keywords for different categories (both English and German)
-    submission_keywords = [
-        # English
-        "application received", "thank you for applying", "received your application", 
-        "successfully submitted", "confirm receipt", "has been received", "application confirmation",
-        "thank you for your interest", "thank you for submitting", "we've received your application",
-        # German
-        "bewerbung eingegangen", "vielen dank für ihre bewerbung", "bewerbung erhalten",
-        "erfolgreich eingereicht", "eingang bestätigen", "ist eingegangen", 
-        "bewerbungsbestätigung", "vielen dank für ihr interesse", "haben ihre bewerbung erhalten", "werden deine unterlagen prüfen"
-    ]
-    
-    rejection_keywords = [
-        # English
-        "regret to inform", "unable to proceed", "not moving forward", "we have decided",
-        "unfortunately", "not selected", "other candidates", "not successful",
-        "does not match", "position has been filled", "no longer available", "we decided to pursue",
-        # German
-        "leider", "bedauern", "nicht weiterverfolgen", "nicht entspricht", 
-        "andere kandidaten", "nicht erfolgreich", "nicht ausgewählt",
-        "position wurde besetzt", "nicht mehr verfügbar", "nicht weiterkommen",
-        "müssen wir ihnen mitteilen", "entschieden haben"
-    ]
-    
-    interview_keywords = [
-        # English
-        "interview", "would like to invite", "next steps", "meet with", "discussion",
-        "schedule a call", "available for a", "assessment", "phone screening", "video call",
-        # German
-        "vorstellungsgespräch", "einladen", "nächste schritte", "termin vereinbaren",
-        "gespräch", "telefonat", "verfügbar für ein", "assessment", "telefoninterview",
-        "videoanruf", "kennenlernen"
-    ]
+    # Log some debugging info to see what we're analyzing
+    logger.debug("Analyzing email content for %s...", company_name)
+    logger.debug("Email body length: %d characters", len(email_body_lower))
     
     # Debug: Check which keywords are found
-    print("Checking for keywords...")
-    
-    # Check for submission keywords
-    for keyword in submission_keywords:
-        if keyword in email_body_lower:
-            print(f"  Found submission keyword: '{keyword}'")
-            return "Application Submitted"
-    
-    # Check for interview keywords (checking before rejection as this is more important)
-    for keyword in interview_keywords:
-        if keyword in email_body_lower:
-            print(f"  Found interview keyword: '{keyword}'")
-            return "Interview Request"
-    
-    # Check for rejection keywords
-    for keyword in rejection_keywords:
-        if keyword in email_body_lower:
-            print(f"  Found rejection keyword: '{keyword}'")
-            return "Application Rejected"
+    logger.debug("Checking for keywords...")
+    
+    # Find the keyword of the most important category (submission, then interview, then rejection)
+    match = _find_category_keyword(email_body_lower)
+    if match:
+        category, label, keyword = match
+        logger.debug("  Found %s keyword: '%s'", label, keyword)
+        return category
     
     # Additional checks for common patterns
     if ("thank" in email_body_lower and "application" in email_body_lower) or \
        ("danke" in email_body_lower and "bewerbung" in email_body_lower):
-        print("  Found 'thank you' + 'application' pattern")
+        logger.debug("  Found 'thank you' + 'application' pattern")
         return "Application Submitted"
     
     # Check for company-specific phrases
-    if company_name.lower() in email_body_lower and "application" in email_body_lower:
-        print("  Found company name + 'application' pattern")
+    if company_name_lower in email_body_lower and "application" in email_body_lower:
+        logger.debug("  Found company name + 'application' pattern")
         return "Application Related"
     
-    print("  No specific keywords matched, categorizing as 'Other'")
+    logger.debug("  No specific keywords matched, categorizing as 'Other'")
     return "Other"
 
 
@@ -316,155 +678,247 @@ def categorize_email(email_body, company_name):
 
 
 
+def decode_text(data, max_length=None):
+    """Decodes the base64url data of a text part, up to about max_length characters."""
+    if max_length is not None:
+        # Every 4 base64 characters hold 3 bytes, and a character is at least one byte
+        data = data[:(max_length + 2) // 3 * 4]
+    return urlsafe_b64decode(data).decode('utf-8', errors='replace')
+
+
 def process_parts(parts):
-    """Process message parts recursively to extract plain text and HTML content."""
-    plain_text = ""
-    html_content = ""
+    """Process message parts to extract plain text and HTML content."""
+    plain_texts = []
+    plain_length = 0
+    html_data = []
     
-    for part in parts:
+    stack = list(reversed(parts))
+    while stack:
+        part = stack.pop()
         mime_type = part.get('mimeType', '')
+        data = part.get('body', {}).get('data')
         
-        if mime_type == 'text/plain' and 'data' in part.get('body', {}):
-            data = part['body']['data']
-            plain_text += base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+        if mime_type == 'text/plain' and data:
+            plain_texts.append(decode_text(data, MAX_BODY_LENGTH - plain_length))
+            plain_length += len(plain_texts[-1])
+            if plain_length >= MAX_BODY_LENGTH:
+                break
         
-        elif mime_type == 'text/html' and 'data' in part.get('body', {}):
-            data = part['body']['data']
-            html_content += base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+        elif mime_type == 'text/html' and data:
+            html_data.append(data)
         
         elif 'parts' in part:
-            # This part has subparts, recurse
-            nested_plain, nested_html = process_parts(part['parts'])
-            plain_text += nested_plain
-            html_content += nested_html
-    
-    return plain_text, html_content
-
-
-def get_text_from_parts(parts):
-    """Recursively extract text from multipart message."""
-    text = ""
-    html = ""
-    
-    for part in parts:
-        if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
-            # This is a plain text part
-            data = part['body']['data']
-            text += base64.urlsafe_b64decode(data).decode('utf-8')
-        elif part.get('mimeType') == 'text/html' and 'data' in part.get('body', {}):
-            # This is an HTML part (store for backup)
-            data = part['body']['data']
-            html += base64.urlsafe_b64decode(data).decode('utf-8')
-        elif 'parts' in part:
-            # This part has subparts, recurse
-            part_text, part_html = get_text_from_parts(part['parts'])
-            text += part_text
-            html += part_html
-    
-    # If we have plain text, use that; otherwise, try to extract text from HTML
-    if text:
-        return text
-    elif html:
-        try:
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(html, 'html.parser')
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.extract()
-            # Get text
-            return soup.get_text(separator=' ', strip=True)
-        except ImportError:
-            # If BeautifulSoup is not available, return a message
-            return "[HTML Email - Install BeautifulSoup to extract text]"
-        except Exception as e:
-            return f"[Error extracting text from HTML: {e}]"
+            # This part has subparts, visit them next
+            stack.extend(reversed(part['parts']))
+    
+    plain_text = ''.join(plain_texts)
+    if plain_text:
+        return plain_text, ''
+    return '', ''.join(decode_text(data) for data in html_data)
+
+
+
+
+def list_messages(service, query, http=None, limit=None):
+    """Returns the most recent messages matching a Gmail query, newest first."""
+    messages = []
+    page_token = None
+    while True:
+        page_size = 500 if limit is None else limit - len(messages)
+        request = service.users().messages().list(userId='me', q=query, pageToken=page_token,
+                                                  maxResults=page_size)
+        results = _with_retry(lambda: request.execute(http=http))
+        messages.extend(results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token or (limit is not None and len(messages) >= limit):
+            return messages[:limit]
+
+
+def _query_term(search_term):
+    """Formats a search term for a Gmail query, quoting anything but a single word."""
+    search_term = search_term.replace('"', '')
+    return search_term if _WORD_RE.fullmatch(search_term) else f'"{search_term}"'
+
+
+def _full_mailbox_scan(service, credentials, cache, date_str, search_terms):
+    """Lists the messages after date_str from or mentioning any company."""
+    # Read the history id first so nothing that arrives during the listing is missed
+    request = service.users().getProfile(userId='me')
+    history_id = _with_retry(request.execute)['historyId']
+    
+    queries = []
+    for start in range(0, len(search_terms), QUERY_CHUNK_SIZE):
+        terms = ' OR '.join(_query_term(term) for term in search_terms[start:start + QUERY_CHUNK_SIZE])
+        queries.append(f"after:{date_str} (from:({terms}) OR subject:({terms}))")
+    
+    # Each search is mostly network wait; the rate limiter keeps them under quota
+    messages = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for found in executor.map(lambda query: list_messages(service, query, _thread_http(credentials)),
+                                  queries):
+            messages.extend(found)
+    cache.execute('DELETE FROM mailbox')
+    cache.executemany('INSERT OR IGNORE INTO mailbox (msg_id) VALUES (?)',
+                      [(message['id'],) for message in messages])
+    return history_id
+
+
+def _apply_mailbox_history(service, cache, history_id):
+    """Applies the mailbox changes made since history_id and returns the new history id."""
+    page_token = None
+    while True:
+        request = service.users().history().list(
+            userId='me', startHistoryId=history_id, pageToken=page_token,
+            historyTypes=['messageAdded', 'messageDeleted', 'labelAdded'])
+        results = _with_retry(request.execute)
+        
+        added, removed = [], []
+        for record in results.get('history', []):
+            for change in record.get('messagesAdded', []):
+                message = change['message']
+                if _HIDDEN_LABELS.isdisjoint(message.get('labelIds', [])):
+                    added.append((message['id'],))
+            for change in record.get('messagesDeleted', []):
+                removed.append((change['message']['id'],))
+            for change in record.get('labelsAdded', []):
+                # Moved to spam or trash, which searches don't include either
+                if not _HIDDEN_LABELS.isdisjoint(change.get('labelIds', [])):
+                    removed.append((change['message']['id'],))
+        cache.executemany('INSERT OR IGNORE INTO mailbox (msg_id) VALUES (?)', added)
+        cache.executemany('DELETE FROM mailbox WHERE msg_id = ?', removed)
+        
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return results['historyId']
+
+
+def sync_mailbox(service, credentials, past_date, search_terms):
+    """Returns the ids of candidate messages received since past_date."""
+    cache = get_email_cache()
+    state = dict(cache.execute('SELECT key, value FROM sync_state'))
+    window_start = past_date.strftime('%Y/%m/%d')
+    searched_terms = set(json.loads(state.get('search_terms', '[]')))
+    
+    # Commits the mailbox changes together, or none of them if Gmail fails midway
+    with cache:
+        history_id = None
+        if (state.get('history_id') and state.get('window_start', window_start) <= window_start
+                and searched_terms.issuperset(search_terms)):
+            try:
+                history_id = _apply_mailbox_history(service, cache, state['history_id'])
+            except HttpError as error:
+                if error.resp.status != 404:
+                    raise
+                logger.info("Gmail history has expired, listing all emails again")
+        if history_id is None:
+            history_id = _full_mailbox_scan(service, credentials, cache, window_start, search_terms)
+            state['window_start'] = window_start
+            state['search_terms'] = json.dumps(sorted(search_terms))
+        
+        # Forget messages that have dropped out of the date window
+        window_start_ms = int(past_date.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() * 1000)
+        cache.execute('DELETE FROM mailbox WHERE msg_id IN '
+                      '(SELECT msg_id FROM message_headers WHERE internal_date < ?)', (window_start_ms,))
+        cache.executemany('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)',
+                          [('history_id', str(history_id)),
+                           ('window_start', state.get('window_start', window_start)),
+                           ('search_terms', state.get('search_terms', '[]'))])
     
-    return text
+    return [msg_id for (msg_id,) in cache.execute('SELECT msg_id FROM mailbox')]
+
+
+@lru_cache(maxsize=None)
+def normalize_company_name(company):
+    """Returns the Gmail search term for a company name."""
+    return _SUFFIX_RE.sub('', company.strip()).lower()
 
 
+def _tokenize(text):
+    """Splits text into lowercase word tokens (e.g. for From and Subject headers)."""
+    return tuple(_WORD_RE.findall(text.lower()))
 
 
-def check_emails_for_companies(service, companies):
+def build_company_index(search_terms):
+    """Builds an index of company search terms keyed by their first word."""
+    index = defaultdict(list)
+    for search_term in search_terms:
+        tokens = _tokenize(search_term)
+        if tokens:
+            index[tokens[0]].append((tokens, search_term))
+    return index
+
+
+def match_companies(text, company_index):
+    """Returns the search terms whose words appear, in order, in the text."""
+    tokens = _tokenize(text)
+    matches = set()
+    for i, token in enumerate(tokens):
+        for term_tokens, search_term in company_index.get(token, ()):
+            if tokens[i:i + len(term_tokens)] == term_tokens:
+                matches.add(search_term)
+    return matches
+
+
+def check_emails_for_companies(service, companies, credentials):
     """Check if there are emails from each company and return the results."""
     
     # Calculate the date X days ago
     past_date = datetime.now() - timedelta(days=DAYS_TO_CHECK)
-    date_str = past_date.strftime('%Y/%m/%d')
     
     company_emails = {}
     
+    # Spellings of the same company ("Acme Inc", "ACME") share a single search term
+    name_variants = defaultdict(list)
     for company in companies:
-        print(f"Checking emails from {company}...")
-        
-        # Clean company name for search (remove special characters, etc.)
-        search_term = company.lower().strip()
-        # Remove common corporate suffixes for better matching
-        for suffix in [' inc', ' llc', ' corp', ' corporation', ' ltd', ' limited', ' group']:
-            search_term = search_term.replace(suffix, '')
-        
-        # Search query: from email contains company name AND after certain date
-        query = f"from:*{search_term}* after:{date_str}"
-        
-        try:
-            # Execute the search
-            results = service.users().messages().list(userId='me', q=query).execute()
-            messages = results.get('messages', [])
-            
-            if messages:
-                # We found emails from this company
-                email_details = []
-                
-                # Limit to at most 5 emails to avoid excessive API calls
-                for message in messages[:5]:
-                    msg_id = message['id']
-                    email_data = extract_email_content(service, msg_id, company)
-                    
-                    email_details.append({
-                        'subject': email_data['subject'],
-                        'sender': email_data['sender'],
-                        'date': email_data['date'],
-                        'body': email_data['body'],
-                        'category': email_data['category']
-                    })
-                
-                company_emails[company] = email_details
-                print(f"  Found {len(messages)} emails from {company}")
-            else:
-                # Try subject line as fallback
-                query = f"subject:*{search_term}* after:{date_str}"
-                results = service.users().messages().list(userId='me', q=query).execute()
-                messages = results.get('messages', [])
-                
-                if messages:
-                    # We found emails with company in subject
-                    email_details = []
-                    
-                    # Limit to at most 5 emails to avoid excessive API calls
-                    for message in messages[:5]:
-                        msg_id = message['id']
-                        email_data = extract_email_content(service, msg_id, company)
-                        
-                        email_details.append({
-                            'subject': email_data['subject'],
-                            'sender': email_data['sender'],
-                            'date': email_data['date'],
-                            'body': email_data['body'],
-                            'category': email_data['category']
-                        })
-                    
-                    company_emails[company] = email_details
-                    print(f"  Found {len(messages)} emails mentioning {company} in subject")
-                else:
-                    print(f"  No emails found from or mentioning {company}")
+        name_variants[normalize_company_name(company)].append(company)
+    company_index = build_company_index(name_variants)
+    search_terms = [search_term for search_term in name_variants if _tokenize(search_term)]
+    
+    try:
+        msg_ids = sync_mailbox(service, credentials, past_date, search_terms)
+    except HttpError as error:
+        logger.error("An error occurred while searching Gmail: %s", error)
+        return company_emails
+    headers = fetch_message_headers(service, msg_ids)
+    
+    # Go through the messages newest first, so each company keeps its most recent ones
+    company_messages = defaultdict(list)
+    for msg_id in sorted(headers, key=lambda msg_id: headers[msg_id][2], reverse=True):
+        sender, subject, _, _ = headers[msg_id]
+        for search_term in match_companies(sender, company_index) | match_companies(subject, company_index):
+            if len(company_messages[search_term]) < MAX_EMAILS_PER_COMPANY:
+                company_messages[search_term].append(msg_id)
+    
+    # Download the matched emails of all companies together; every spelling
+    # gets its own categories, as categorize_email looks for the company name
+    found = fetch_email_contents(service, {name: company_messages[search_term]
+                                           for search_term, names in name_variants.items()
+                                           if company_messages.get(search_term)
+                                           for name in names}, headers)
+    
+    for search_term, names in name_variants.items():
+        company = ', '.join(names)
         
-        except HttpError as error:
-            print(f"An error occurred while searching for {company}: {error}")
+        if names[0] in found:
+            # We found emails from or mentioning this company; report them
+            # under every spelling used in the spreadsheet
+            for name in names:
+                company_emails[name] = [{
+                    'subject': email_data['subject'],
+                    'sender': email_data['sender'],
+                    'date': email_data['date'],
+                    'body': email_data['body'],
+                    'category': email_data['category']
+                } for email_data in found[name]]
+            logger.debug("Found %d emails from or mentioning %s", len(found[names[0]]), company)
+        else:
+            logger.debug("No emails found from or mentioning %s", company)
     
     return company_emails
 
 
 
-def print_results(company_emails):
+def print_results(company_emails, all_companies):
     """Print the results in a readable format with categorization."""
     print("\n" + "="*80)
     print("RESULTS: COMPANY EMAIL CHECK")
@@ -544,8 +998,7 @@ def print_results(company_emails):
     
     # Now list companies with no emails
     companies_with_emails = set(company_emails.keys())
-    all_companies = set(load_companies())
-    companies_with_no_emails = all_companies - companies_with_emails
+    companies_with_no_emails = set(all_companies) - companies_with_emails
     
     if companies_with_no_emails:
         print("\n" + "-"*80)
@@ -557,6 +1010,8 @@ def print_results(company_emails):
 
 
 def main():
+    # Set LOGLEVEL=DEBUG to see how each email is parsed and categorized
+    logging.basicConfig(level=os.environ.get('LOGLEVEL', 'INFO').upper(), format='%(message)s')
     print("Starting Job Application Email Analyzer...")
     
     # Load company names from Excel
@@ -569,24 +1024,25 @@ def main():
     
     # Get Gmail service
     try:
-        service = get_gmail_service()
+        creds = get_credentials()
+        service = get_gmail_service(creds)
     except Exception as e:
         print(f"Error authenticating with Gmail: {e}")
         print("Please ensure you've set up the Gmail API correctly.")
         return
     
     # Check for emails from companies
-    company_emails = check_emails_for_companies(service, companies)
+    company_emails = check_emails_for_companies(service, companies, creds)
     
     # Print the initial results
-    print_results(company_emails)
+    print_results(company_emails, companies)
     
     # Ask if user wants to manually review categories
     review_choice = input("\nWould you like to manually review and adjust categories? (y/n) [n]: ").strip().lower()
     if review_choice == 'y':
         company_emails = manual_category_review(company_emails)
         # Print updated results
-        print_results(company_emails)
+        print_results(company_emails, companies)
     
 
     